@@ -45,6 +45,8 @@ def create_app(config_class=Config):
     log_dir = app.config['LOG_DIR']
     log_file = app.config['LOG_FILE']
     os.makedirs(log_dir, exist_ok=True)
+    # Created once here rather than by every download worker.
+    os.makedirs(app.config['DOWNLOADS_DIR'], exist_ok=True)
     file_handler = RotatingFileHandler(log_file, maxBytes=1024*1024*5, backupCount=5)
     stream_handler = logging.StreamHandler()
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -3,20 +3,18 @@ from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 from sqlalchemy.exc import IntegrityError
-import psutil
 import threading
 import json
 import time
 import os
 import requests
 
-from ..models import db, DownloadLog, Setting, DownloadStatus, User, UserRole
-from ..worker import download_thread_target
-from ..helpers import get_filename_from_headers, is_safe_url, read_last_n_lines
+from ..models import db, DownloadLog, Setting, DownloadStatus, User, UserRole, ACTIVE_STATUSES, FINISHED_STATUSES
+from ..worker import submit_download
+from ..helpers import get_filename_from_headers, is_safe_url, read_last_n_lines, http_session
 from ..stats_collector import system_stats
 from ..decorators import api_admin_required
 from ..forms import ProxyUrlForm
-from ..extensions import csrf
 
 api_bp = Blueprint('api', __name__)
 
@@ -33,10 +31,13 @@ def api_stats():
     downloads = DownloadLog.query.order_by(DownloadLog.created_at.desc()).all()
     all_downloads = [d.to_dict() for d in downloads]
 
-    total_traffic = db.session.query(db.func.sum(DownloadLog.size_bytes)).filter(DownloadLog.status == DownloadStatus.COMPLETED).scalar() or 0
-
-    stored_files_count = DownloadLog.query.filter_by(status=DownloadStatus.COMPLETED).count()
-    total_stored_size = db.session.query(db.func.sum(DownloadLog.size_bytes)).filter(DownloadLog.status == DownloadStatus.COMPLETED).scalar() or 0
+    # Count and size of completed files come from one aggregate query; traffic
+    # and stored size are the same sum, so it is computed only once.
+    stored_files_count, total_stored_size = db.session.query(
+        db.func.count(DownloadLog.id), db.func.sum(DownloadLog.size_bytes)
+    ).filter(DownloadLog.status == DownloadStatus.COMPLETED).one()
+    total_stored_size = total_stored_size or 0
+    total_traffic = total_stored_size
 
     return jsonify({
         "system": current_stats,
@@ -69,10 +70,7 @@ def start_proxy_download():
         current_app.logger.info(f"User provided custom filename: '{custom_filename}'")
 
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
-        }
-        with requests.get(remote_url, stream=True, timeout=10, headers=headers) as r:
+        with http_session.get(remote_url, stream=True, timeout=10) as r:
             r.raise_for_status()
 
             if custom_filename:
@@ -105,10 +103,9 @@ def start_proxy_download():
         )
         db.session.add(log_entry)
         db.session.commit()
-        current_app.logger.info(f"Queued '{filename}' for download. Starting worker thread.")
+        current_app.logger.info(f"Queued '{filename}' for download. Submitting to download pool.")
 
-        thread = threading.Thread(target=download_thread_target, args=(current_app._get_current_object(), log_entry.id))
-        thread.start()
+        submit_download(current_app._get_current_object(), log_entry.id)
 
         return jsonify(log_entry.to_dict()), 202
 
@@ -136,12 +133,13 @@ def delete_file(filename):
 
     DOWNLOADS_DIR = current_app.config['DOWNLOADS_DIR']
     file_path = os.path.join(DOWNLOADS_DIR, safe_filename)
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            current_app.logger.info(f"User '{current_user.username}' deleted physical file: {file_path}")
-        except OSError as e:
-            current_app.logger.error(f"Error deleting physical file {file_path} for user '{current_user.username}': {e}", exc_info=True)
+    try:
+        os.remove(file_path)
+        current_app.logger.info(f"User '{current_user.username}' deleted physical file: {file_path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        current_app.logger.error(f"Error deleting physical file {file_path} for user '{current_user.username}': {e}", exc_info=True)
 
     db.session.delete(log_entry)
     db.session.commit()
@@ -170,9 +168,11 @@ def rename_file_api(filename):
     new_path = os.path.join(DOWNLOADS_DIR, new_filename)
 
     try:
-        if os.path.exists(old_path):
+        try:
             os.rename(old_path, new_path)
             current_app.logger.info(f"User '{current_user.username}' renamed file '{safe_filename}' to '{new_filename}'")
+        except FileNotFoundError:
+            pass
 
         log_entry.filename = new_filename
         db.session.commit()
@@ -194,7 +194,7 @@ def cancel_download(filename):
         current_app.logger.warning(f"User '{current_user.username}' failed to cancel non-existent download: {safe_filename}")
         abort(404, "File not found")
 
-    if log_entry.status not in [DownloadStatus.QUEUED, DownloadStatus.DOWNLOADING]:
+    if log_entry.status not in ACTIVE_STATUSES:
         current_app.logger.warning(f"User '{current_user.username}' attempted to cancel a download that is not active: {safe_filename} (Status: {log_entry.status.value})")
         return jsonify({"error": "Download is not in a cancellable state."}), 400
 
@@ -205,56 +205,90 @@ def cancel_download(filename):
 
     return jsonify({"success": True}), 200
 
-@api_bp.route('/stream')
-@login_required
-def stream():
-    app = current_app._get_current_object()
-    def event_stream():
-        while True:
+# The serialized /stream payload is shared by every SSE client in this process,
+# so the database is polled at most once per STREAM_SNAPSHOT_TTL seconds no
+# matter how many dashboards are open.
+STREAM_SNAPSHOT_TTL = 1
+_stream_snapshot = {
+    "payload": None,
+    "expires_at": 0.0,
+    "lock": threading.Lock()
+}
+
+def _get_stream_payload(app):
+    with _stream_snapshot['lock']:
+        now = time.monotonic()
+        if now >= _stream_snapshot['expires_at']:
             with app.app_context():
                 active_downloads = DownloadLog.query.filter(
-                    DownloadLog.status.in_([DownloadStatus.QUEUED, DownloadStatus.DOWNLOADING])
+                    DownloadLog.status.in_(ACTIVE_STATUSES)
                 ).order_by(DownloadLog.created_at.desc()).all()
 
                 finished_downloads = DownloadLog.query.filter(
-                    DownloadLog.status.in_([DownloadStatus.COMPLETED, DownloadStatus.FAILED, DownloadStatus.CANCELLED])
+                    DownloadLog.status.in_(FINISHED_STATUSES)
                 ).order_by(DownloadLog.updated_at.desc()).limit(5).all()
 
                 payload = {
                     "active": [d.to_dict() for d in active_downloads],
                     "finished": [d.to_dict() for d in finished_downloads]
                 }
-                yield f"data: {json.dumps(payload)}\n\n"
+            _stream_snapshot['payload'] = json.dumps(payload)
+            _stream_snapshot['expires_at'] = now + STREAM_SNAPSHOT_TTL
+        return _stream_snapshot['payload']
+
+@api_bp.route('/stream')
+@login_required
+def stream():
+    app = current_app._get_current_object()
+    def event_stream():
+        last_payload = None
+        while True:
+            payload = _get_stream_payload(app)
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload = payload
+            else:
+                # Nothing changed since the last event; a comment line keeps the
+                # connection alive without making the client re-render.
+                yield ": keepalive\n\n"
             time.sleep(2)
     return Response(event_stream(), mimetype='text/event-stream')
 
 @api_bp.route('/settings', methods=['GET', 'POST'])
 @login_required
 def manage_settings():
+    # Both rows are loaded once and reused for the update and the response.
+    settings = {
+        s.key: s for s in
+        Setting.query.filter(Setting.key.in_(('cleanup_interval', 'auto_cleanup_enabled'))).all()
+    }
+    interval_setting = settings.get('cleanup_interval')
+    enabled_setting = settings.get('auto_cleanup_enabled')
+
     if request.method == 'POST':
         data = request.json
         interval = data.get('cleanup_interval')
         enabled = data.get('auto_cleanup_enabled')
 
         if interval:
-            setting = Setting.query.filter_by(key='cleanup_interval').first()
-            if setting and interval.isdigit():
-                setting.value = str(interval)
+            if interval_setting and interval.isdigit():
+                interval_setting.value = str(interval)
 
         if enabled is not None:
-            setting = Setting.query.filter_by(key='auto_cleanup_enabled').first()
-            if setting:
-                setting.value = str(enabled).lower()
-
-        db.session.commit()
+            if enabled_setting:
+                enabled_setting.value = str(enabled).lower()
 
-    interval_setting = Setting.query.filter_by(key='cleanup_interval').first()
-    enabled_setting = Setting.query.filter_by(key='auto_cleanup_enabled').first()
-
-    return jsonify({
+    # Built before committing, which would otherwise expire the rows and
+    # reload each of them just to echo back the values written above.
+    response = {
         "cleanup_interval": interval_setting.value if interval_setting else '60',
         "auto_cleanup_enabled": enabled_setting.value if enabled_setting else 'false'
-    })
+    }
+
+    if request.method == 'POST':
+        db.session.commit()
+
+    return jsonify(response)
 
 # --- Admin API Routes ---
 
@@ -7,6 +7,7 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:////data/proxy.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DOWNLOADS_DIR = '/data/downloads'
+    MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 4))
     LOG_DIR = '/data'
     LOG_FILE = os.path.join(LOG_DIR, 'app.log')
     RATELIMIT_STORAGE_URI = "redis://redis:6379/0"
@@ -1,7 +1,6 @@
 from functools import wraps
 from flask_login import current_user
 from flask import jsonify, flash, redirect, url_for
-from .models import UserRole
 
 def api_admin_required(f):
     @wraps(f)
@@ -1,13 +1,50 @@
 # This file will contain helper functions.
+import os
 import re
 import socket
+import http.cookiejar
 from urllib.parse import urlparse
 from ipaddress import ip_address, AddressValueError
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
+
+# A single pooled session shared by the API and the download workers, so that
+# requests to a host reuse keep-alive connections from one pool instead of
+# opening a new TCP/TLS connection each time.
+# Connection failures and transient upstream errors are retried with backoff
+# before a response is handed back; raise_for_status() still sees the last one.
+# Retry-After is ignored: the URLs are user-supplied, and honouring an
+# arbitrary delay would let any server park a request (and a pool slot)
+# indefinitely. Backoff alone keeps the added wait to a couple of seconds.
+http_session = requests.Session()
+http_session.headers['User-Agent'] = USER_AGENT
+# The session serves every user, so it must not keep cookies: a Set-Cookie from
+# one user's download would otherwise be sent with everyone's later requests.
+http_session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['HEAD', 'GET'],
+        respect_retry_after_header=False,
+        raise_on_status=False
+    )
+)
+http_session.mount('http://', _adapter)
+http_session.mount('https://', _adapter)
+
+_FILENAME_RE = re.compile(r'filename="(.+?)"')
 
 def get_filename_from_headers(headers):
     if cd := headers.get('content-disposition'):
-        if filenames := re.findall('filename="(.+?)"', cd):
-            return filenames[0]
+        if match := _FILENAME_RE.search(cd):
+            return match.group(1)
     return None
 
 def is_safe_url(url):
@@ -26,37 +63,34 @@ def is_safe_url(url):
         # Could not resolve hostname or invalid IP, treat as unsafe.
         return False
 
-import os
-from collections import deque
-
 def read_last_n_lines(filepath, n):
     """
     Reads the last n lines of a file efficiently without reading the entire
     file into memory. It seeks to the end and reads backwards.
     """
     try:
-        if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-            return []
-
+        # A missing file raises FileNotFoundError from open() and an empty one
+        # leaves end_pos at 0, so no separate exists/getsize probes are needed.
         with open(filepath, "rb") as f:
             f.seek(0, os.SEEK_END)
-            buffer = bytearray()
+            chunks = []
             end_pos = f.tell()
             lines_found = 0
 
             while lines_found <= n and end_pos > 0:
                 # Seek backwards from current position
-                seek_pos = max(0, end_pos - 1024)
+                seek_pos = max(0, end_pos - 8192)
                 f.seek(seek_pos)
 
-                # Prepend read chunk to our buffer
-                buffer = f.read(end_pos - seek_pos) + buffer
+                # Collect chunks in reverse and only count newlines in the new
+                # chunk, rather than re-copying and re-scanning a growing buffer.
+                chunk = f.read(end_pos - seek_pos)
+                chunks.append(chunk)
                 end_pos = seek_pos
-
-                # Count newlines in the current buffer
-                lines_found = buffer.count(b'\n')
+                lines_found += chunk.count(b'\n')
 
             # Decode buffer and split into lines
+            buffer = b''.join(reversed(chunks))
             lines = buffer.decode('utf-8', errors='ignore').splitlines()
 
             # Return the last n lines
@@ -10,6 +10,11 @@ class DownloadStatus(enum.Enum):
     FAILED = "FAILED"
     CANCELLED = "CANCELLED"
 
+# Status groups shared by the API checks and queries. Tuples so they can be
+# passed straight to Column.in_() as well as used in membership tests.
+ACTIVE_STATUSES = (DownloadStatus.QUEUED, DownloadStatus.DOWNLOADING)
+FINISHED_STATUSES = (DownloadStatus.COMPLETED, DownloadStatus.FAILED, DownloadStatus.CANCELLED)
+
 class UserRole(enum.Enum):
     ADMIN = "ADMIN"
     USER = "USER"
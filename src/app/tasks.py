@@ -1,4 +1,3 @@
-import threading
 import time
 import os
 from datetime import datetime, timedelta
@@ -72,10 +71,13 @@ def cleanup_thread_target(flask_app):
     with flask_app.app_context():
         while True:
             try:
-                auto_cleanup_enabled = Setting.query.filter_by(key='auto_cleanup_enabled').first()
-                if auto_cleanup_enabled and auto_cleanup_enabled.value == 'true':
-                    cleanup_interval_setting = Setting.query.filter_by(key='cleanup_interval').first()
-                    interval_minutes = int(cleanup_interval_setting.value) if cleanup_interval_setting else 60
+                # Fetch both cleanup settings in a single query per pass.
+                settings = {
+                    s.key: s.value for s in
+                    Setting.query.filter(Setting.key.in_(('auto_cleanup_enabled', 'cleanup_interval'))).all()
+                }
+                if settings.get('auto_cleanup_enabled') == 'true':
+                    interval_minutes = int(settings.get('cleanup_interval', 60))
 
                     cleanup_threshold = datetime.utcnow() - timedelta(minutes=interval_minutes)
 
@@ -86,19 +88,32 @@ def cleanup_thread_target(flask_app):
 
                     if old_files:
                         flask_app.logger.info(f"Auto-cleanup: Found {len(old_files)} old files to delete.")
+                        deleted_ids = []
+                        deleted_names = []
                         for log_entry in old_files:
+                            file_path = os.path.join(flask_app.config['DOWNLOADS_DIR'], log_entry.filename)
                             try:
-                                file_path = os.path.join(flask_app.config['DOWNLOADS_DIR'], log_entry.filename)
-                                if os.path.exists(file_path):
-                                    os.remove(file_path)
-                                    flask_app.logger.info(f"Auto-cleanup: Deleted physical file: {file_path}")
+                                os.remove(file_path)
+                                flask_app.logger.info(f"Auto-cleanup: Deleted physical file: {file_path}")
+                            except FileNotFoundError:
+                                pass
+                            except OSError as e:
+                                # Keep the log so the next pass retries this file.
+                                flask_app.logger.error(f"Auto-cleanup: Error deleting file {log_entry.filename}: {e}", exc_info=True)
+                                continue
 
-                                db.session.delete(log_entry)
-                                db.session.commit()
-                                flask_app.logger.info(f"Auto-cleanup: Deleted file log: {log_entry.filename}")
+                            deleted_ids.append(log_entry.id)
+                            deleted_names.append(log_entry.filename)
 
+                        # Remove the logs of every file that was cleaned up in one
+                        # statement and one commit, instead of a commit per file.
+                        if deleted_ids:
+                            try:
+                                DownloadLog.query.filter(DownloadLog.id.in_(deleted_ids)).delete(synchronize_session=False)
+                                db.session.commit()
+                                flask_app.logger.info(f"Auto-cleanup: Deleted {len(deleted_ids)} file logs: {', '.join(deleted_names)}")
                             except Exception as e:
-                                flask_app.logger.error(f"Auto-cleanup: Error deleting file {log_entry.filename}: {e}", exc_info=True)
+                                flask_app.logger.error(f"Auto-cleanup: Error deleting file logs: {e}", exc_info=True)
                                 db.session.rollback()
 
                 # Check every 5 minutes
@@ -1,13 +1,366 @@
 import os
+import re
 import time
-import uuid
+import random
+import itertools
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 from .models import db, DownloadLog, DownloadStatus
+from .helpers import http_session
+
+# Seconds between progress/cancellation checks against the database.
+PROGRESS_INTERVAL = 2
+
+# Read size for streamed bodies. Large enough that the per-chunk Python work
+# (write, counter, deadline check) is negligible next to the socket reads.
+CHUNK_SIZE = 256 * 1024
+
+# Files at least this large are fetched as parallel byte ranges when the
+# remote server supports them.
+RANGED_MIN_SIZE = 16 * 1024 * 1024
+RANGED_PARTS = 4
+
+# Weight given to the newest speed sample. Reported speed is an exponential
+# moving average so the UI does not jump around with every burst.
+SPEED_SMOOTHING = 0.3
+
+# How many times an interrupted transfer (single stream or one range part) is
+# resumed before failing.
+RESUME_ATTEMPTS = 3
+
+# Resume attempts back off exponentially (1s, 2s, 4s, ... capped), with up to
+# a second of jitter so downloads cut off together do not reconnect together.
+RESUME_BACKOFF_BASE = 1
+RESUME_BACKOFF_MAX = 10
+
+# Transient network failures that are worth resuming after. Anything else
+# (HTTP errors, disk errors, bugs) fails the download immediately.
+RETRYABLE_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-')
+
+# Temp file suffixes only need to be unique across the gunicorn workers sharing
+# DOWNLOADS_DIR, so a per-process counter plus the pid is enough.
+_temp_counter = itertools.count(1)
 
 class OperationAborted(Exception):
     """Custom exception for cancelled operations."""
     pass
 
+class RangesNotSupported(Exception):
+    """Raised when the remote server answers a Range request with the full body."""
+    pass
+
+# Downloads run on a bounded pool so a burst of submissions cannot open an
+# unbounded number of connections. Jobs stay QUEUED until a slot frees up.
+_download_executor = None
+_executor_lock = threading.Lock()
+
+def submit_download(flask_app, download_id):
+    global _download_executor
+    with _executor_lock:
+        if _download_executor is None:
+            _download_executor = ThreadPoolExecutor(
+                max_workers=flask_app.config['MAX_CONCURRENT_DOWNLOADS'],
+                thread_name_prefix='download'
+            )
+    future = _download_executor.submit(download_thread_target, flask_app, download_id)
+
+    # The pool keeps anything that escapes the worker on the future, where
+    # nobody would see it; log it instead of leaving the row stuck.
+    def _log_unhandled(future):
+        if exc := future.exception():
+            flask_app.logger.error(
+                f"Download worker for ID {download_id} crashed: {exc}",
+                exc_info=(type(exc), exc, exc.__traceback__)
+            )
+    future.add_done_callback(_log_unhandled)
+
+def _report_progress(download_id, downloaded_bytes, speed_bps):
+    """
+    Publishes progress for a running download. A single conditional UPDATE both
+    records progress and detects cancellation: no row matches once the status
+    leaves DOWNLOADING, in which case OperationAborted is raised.
+    """
+    updated = DownloadLog.query.filter_by(
+        id=download_id, status=DownloadStatus.DOWNLOADING
+    ).update(
+        {'progress_bytes': downloaded_bytes, 'speed_bps': int(speed_bps)},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if not updated:
+        raise OperationAborted("Download was cancelled by user.")
+
+def _smooth_speed(previous_bps, instant_bps):
+    if previous_bps is None:
+        return instant_bps
+    return (1 - SPEED_SMOOTHING) * previous_bps + SPEED_SMOOTHING * instant_bps
+
+def _resume_delay(attempt):
+    return min(RESUME_BACKOFF_MAX, RESUME_BACKOFF_BASE * 2 ** (attempt - 1)) + random.uniform(0, 1)
+
+def _preallocate(fd, size, logger):
+    """
+    Reserves size bytes for the file up front so the filesystem can lay it out
+    contiguously instead of extending it chunk by chunk. Best effort: a no-op
+    where posix_fallocate is unavailable or fails, since size comes from a
+    remote header and the download itself will still surface a real disk error.
+    """
+    if size > 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as e:
+            logger.debug(f"Could not preallocate {size} bytes: {e}")
+
+def _strong_validator(headers):
+    """
+    Returns the value to send in If-Range for a response: its ETag when that is
+    a strong one, otherwise its Last-Modified date (or None).
+    """
+    etag = headers.get('etag')
+    return etag if etag and not etag.startswith('W/') else headers.get('last-modified')
+
+def _content_range_start(headers):
+    if match := _CONTENT_RANGE_RE.match(headers.get('content-range', '')):
+        return int(match.group(1))
+    return None
+
+def _probe_range_support(url):
+    """
+    Returns (size, validator) if the server advertises byte-range support for
+    an unencoded body, otherwise (0, None).
+    """
+    try:
+        r = http_session.head(url, allow_redirects=True, timeout=30, headers={'Accept-Encoding': 'identity'})
+    except requests.exceptions.RequestException:
+        return 0, None
+    if not r.ok or r.headers.get('accept-ranges', '').lower() != 'bytes' or r.headers.get('content-encoding'):
+        return 0, None
+    return int(r.headers.get('content-length', 0)), _strong_validator(r.headers)
+
+def _fetch_range(url, validator, fd, start, end, part_progress, index, abort, logger):
+    """
+    Fetches bytes start..end of url into fd. An interrupted range is reissued
+    from the last byte written, with the same backoff as single-stream resumes.
+    If-Range makes a server whose file changed answer with the full body, which
+    surfaces as RangesNotSupported rather than splicing two versions together.
+    """
+    offset = start
+    attempt = 0
+    while True:
+        headers = {'Range': f'bytes={offset}-{end}', 'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+
+        try:
+            with http_session.get(url, stream=True, timeout=300, headers=headers) as r:
+                if r.status_code == 416:
+                    # The probed size was larger than the real body.
+                    raise RangesNotSupported(f"Range {offset}-{end} not satisfiable")
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RangesNotSupported(f"Expected 206 for range {offset}-{end}, got {r.status_code}")
+                if _content_range_start(r.headers) != offset:
+                    raise RangesNotSupported(f"Range {offset}-{end} answered with Content-Range {r.headers.get('content-range')!r}")
+                if r.headers.get('content-encoding'):
+                    # iter_content would yield decoded bytes for encoded offsets.
+                    raise RangesNotSupported(f"Range {offset}-{end} answered with Content-Encoding {r.headers.get('content-encoding')!r}")
+
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    if abort.is_set():
+                        return
+                    # Never write past this part, even if the server sends more.
+                    chunk = chunk[:end + 1 - offset]
+                    # pwrite keeps the parts from contending on a shared file offset.
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+                    part_progress[index] = offset - start
+                    if offset > end:
+                        break
+
+        except RETRYABLE_EXCEPTIONS as e:
+            attempt += 1
+            if attempt > RESUME_ATTEMPTS:
+                raise
+            reason = e
+        else:
+            if offset > end:
+                return
+            attempt += 1
+            if attempt > RESUME_ATTEMPTS:
+                raise IOError(f"Range {start}-{end} ended early at byte {offset}")
+            reason = "connection closed early"
+
+        delay = _resume_delay(attempt)
+        logger.warning(
+            f"Range {start}-{end} of {url} interrupted at byte {offset} ({reason}). "
+            f"Resuming in {delay:.1f}s (attempt {attempt}/{RESUME_ATTEMPTS})."
+        )
+        if abort.wait(delay):
+            return
+
+def _ranged_download(download_id, url, validator, temp_filepath, size, logger):
+    """
+    Downloads url into temp_filepath as RANGED_PARTS concurrent byte ranges
+    written into a preallocated file. Raises RangesNotSupported if the server
+    ignores the Range header so the caller can fall back to a single stream.
+    """
+    part_size = -(-size // RANGED_PARTS)
+    ranges = [(lo, min(lo + part_size, size) - 1) for lo in range(0, size, part_size)]
+    part_progress = [0] * len(ranges)
+    abort = threading.Event()
+
+    fd = os.open(temp_filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _preallocate(fd, size, logger)
+
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='range') as executor:
+            futures = [
+                executor.submit(_fetch_range, url, validator, fd, lo, hi, part_progress, i, abort, logger)
+                for i, (lo, hi) in enumerate(ranges)
+            ]
+            last_update_time = time.monotonic()
+            last_update_bytes = 0
+            speed_bps = None
+            try:
+                while True:
+                    done, pending = wait(futures, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+                    for future in done:
+                        future.result()
+                    if not pending:
+                        break
+
+                    current_time = time.monotonic()
+                    downloaded_bytes = sum(part_progress)
+                    instant_bps = (downloaded_bytes - last_update_bytes) / (current_time - last_update_time) * 8
+                    speed_bps = _smooth_speed(speed_bps, instant_bps)
+                    _report_progress(download_id, downloaded_bytes, speed_bps)
+                    last_update_time = current_time
+                    last_update_bytes = downloaded_bytes
+            except BaseException:
+                # Stop the remaining parts before the executor waits on them.
+                abort.set()
+                raise
+    finally:
+        os.close(fd)
+
+def _stream_download(flask_app, log_entry, download_id, temp_filepath):
+    """
+    Streams the remote file into temp_filepath. If the connection drops
+    mid-transfer, the request is reissued with a Range header starting at the
+    bytes already written, guarded by If-Range so a changed remote file is
+    fetched again from scratch instead of being spliced.
+    """
+    url = log_entry.remote_url
+    downloaded_bytes = 0
+    validator = None
+    resumable = False
+    attempt = 0
+
+    last_update_time = time.monotonic()
+    last_update_bytes = 0
+    next_update_at = last_update_time + PROGRESS_INTERVAL
+    speed_bps = None
+
+    with open(temp_filepath, 'wb') as f:
+        while True:
+            headers = {}
+            if downloaded_bytes:
+                headers['Range'] = f'bytes={downloaded_bytes}-'
+                if validator:
+                    headers['If-Range'] = validator
+
+            try:
+                with http_session.get(url, stream=True, timeout=300, headers=headers) as r:
+                    r.raise_for_status()
+
+                    # Only a 206 to a Range request is a continuation; a 206 to
+                    # the initial, unranged request is treated like a 200.
+                    resumed = bool(downloaded_bytes) and r.status_code == 206
+
+                    if resumed and _content_range_start(r.headers) != downloaded_bytes:
+                        # A partial body that does not continue where the file
+                        # left off cannot be appended; start over without Range.
+                        attempt += 1
+                        if attempt > RESUME_ATTEMPTS:
+                            raise IOError(f"Server kept resuming '{log_entry.filename}' at the wrong offset")
+                        flask_app.logger.info(f"Server resumed '{log_entry.filename}' at the wrong offset. Restarting from the beginning.")
+                        f.seek(0)
+                        f.truncate()
+                        downloaded_bytes = 0
+                        last_update_bytes = 0
+                        continue
+
+                    if not resumed:
+                        # A full body, either the first response or a server that
+                        # could not (or would not) resume: start the file over.
+                        if downloaded_bytes:
+                            flask_app.logger.info(f"Server could not resume '{log_entry.filename}'. Restarting from the beginning.")
+                            f.seek(0)
+                            f.truncate()
+                            downloaded_bytes = 0
+                            last_update_bytes = 0
+
+                        validator = _strong_validator(r.headers)
+                        # Range offsets refer to the encoded body, while iter_content
+                        # yields decoded bytes, so only unencoded bodies can resume.
+                        resumable = not r.headers.get('content-encoding')
+
+                        content_length = int(r.headers.get('content-length', 0))
+                        if resumable:
+                            _preallocate(f.fileno(), content_length, flask_app.logger)
+
+                        if log_entry.size_bytes == 0:
+                            log_entry.size_bytes = content_length
+                            db.session.commit()
+                            flask_app.logger.info(f"Updated size for '{log_entry.filename}' to {log_entry.size_bytes} bytes")
+
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            downloaded_bytes += len(chunk)
+
+                            # Only a clock read and a compare per chunk; the database is
+                            # touched once per PROGRESS_INTERVAL.
+                            current_time = time.monotonic()
+                            if current_time >= next_update_at:
+                                elapsed_time = current_time - last_update_time
+                                bytes_since_last_update = downloaded_bytes - last_update_bytes
+                                speed_bps = _smooth_speed(speed_bps, (bytes_since_last_update / elapsed_time) * 8)
+                                _report_progress(download_id, downloaded_bytes, speed_bps)
+
+                                last_update_time = current_time
+                                last_update_bytes = downloaded_bytes
+                                next_update_at = current_time + PROGRESS_INTERVAL
+
+                # Drop any preallocated space the body did not fill.
+                f.truncate()
+                return
+
+            except RETRYABLE_EXCEPTIONS as e:
+                attempt += 1
+                if not resumable or attempt > RESUME_ATTEMPTS:
+                    raise
+                delay = _resume_delay(attempt)
+                flask_app.logger.warning(
+                    f"Transfer of '{log_entry.filename}' interrupted at {downloaded_bytes} bytes ({e}). "
+                    f"Resuming in {delay:.1f}s (attempt {attempt}/{RESUME_ATTEMPTS})."
+                )
+                time.sleep(delay)
+
+def _remove_temp_file(flask_app, temp_filepath, reason):
+    try:
+        os.remove(temp_filepath)
+        flask_app.logger.info(f"Removed temporary file for {reason} download: {temp_filepath}")
+    except FileNotFoundError:
+        pass
+
 def download_thread_target(flask_app, download_id):
     with flask_app.app_context():
         log_entry = DownloadLog.query.get(download_id)
@@ -19,76 +372,53 @@ def download_thread_target(flask_app, download_id):
             flask_app.logger.info(f"Download '{log_entry.filename}' was cancelled before starting. Worker exiting.")
             return
 
-        unique_id = uuid.uuid4().hex
+        # Kept locally: the row may be deleted mid-download, after which the
+        # expired ORM instance can no longer be refreshed.
+        filename = log_entry.filename
+        unique_id = f"{os.getpid()}-{next(_temp_counter)}"
         DOWNLOADS_DIR = flask_app.config['DOWNLOADS_DIR']
-        temp_filepath = os.path.join(DOWNLOADS_DIR, f"{log_entry.filename}.{unique_id}.tmp")
-        final_filepath = os.path.join(DOWNLOADS_DIR, log_entry.filename)
-        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+        temp_filepath = os.path.join(DOWNLOADS_DIR, f"{filename}.{unique_id}.tmp")
+        final_filepath = os.path.join(DOWNLOADS_DIR, filename)
 
         try:
             log_entry.status = DownloadStatus.DOWNLOADING
             db.session.commit()
-            flask_app.logger.info(f"Starting download for '{log_entry.filename}' from {log_entry.remote_url}")
+            flask_app.logger.info(f"Starting download for '{filename}' from {log_entry.remote_url}")
 
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
-            }
-            with requests.get(log_entry.remote_url, stream=True, timeout=300, headers=headers) as r:
-                r.raise_for_status()
+            ranged_size, validator = 0, None
+            if log_entry.size_bytes >= RANGED_MIN_SIZE:
+                ranged_size, validator = _probe_range_support(log_entry.remote_url)
 
-                if log_entry.size_bytes == 0:
-                    log_entry.size_bytes = int(r.headers.get('content-length', 0))
-                    flask_app.logger.info(f"Updated size for '{log_entry.filename}' to {log_entry.size_bytes} bytes")
+            if ranged_size:
+                try:
+                    _ranged_download(download_id, log_entry.remote_url, validator, temp_filepath, ranged_size, flask_app.logger)
+                    log_entry.size_bytes = ranged_size
+                except RangesNotSupported:
+                    flask_app.logger.info(f"Server ignored range requests for '{filename}'. Falling back to a single stream.")
+                    ranged_size = 0
 
-                downloaded_bytes = 0
-                last_update_time = time.time()
-                last_update_bytes = 0
-
-                with open(temp_filepath, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded_bytes += len(chunk)
-
-                            current_time = time.time()
-                            elapsed_time = current_time - last_update_time
-
-                            if elapsed_time > 2:
-                                db.session.refresh(log_entry)
-                                if log_entry.status == DownloadStatus.CANCELLED:
-                                    flask_app.logger.info(f"Cancellation detected for '{log_entry.filename}'. Stopping download.")
-                                    raise OperationAborted("Download was cancelled by user.")
-
-                                bytes_since_last_update = downloaded_bytes - last_update_bytes
-                                speed_bps = (bytes_since_last_update / elapsed_time) * 8
-
-                                log_entry.progress_bytes = downloaded_bytes
-                                log_entry.speed_bps = int(speed_bps)
-                                db.session.commit()
-
-                                last_update_time = current_time
-                                last_update_bytes = downloaded_bytes
+            if not ranged_size:
+                _stream_download(flask_app, log_entry, download_id, temp_filepath)
 
-            os.rename(temp_filepath, final_filepath)
+            # The temp file sits next to the final path, so this is a same-filesystem,
+            # atomic swap that also replaces any stale file left under that name.
+            os.replace(temp_filepath, final_filepath)
 
             log_entry.progress_bytes = log_entry.size_bytes
             log_entry.status = DownloadStatus.COMPLETED
             log_entry.speed_bps = 0
             db.session.commit()
-            flask_app.logger.info(f"Successfully completed download for '{log_entry.filename}'")
+            flask_app.logger.info(f"Successfully completed download for '{filename}'")
 
         except OperationAborted:
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-                flask_app.logger.info(f"Removed temporary file for cancelled download: {temp_filepath}")
+            flask_app.logger.info(f"Cancellation detected for '{filename}'. Stopping download.")
+            _remove_temp_file(flask_app, temp_filepath, 'cancelled')
         except Exception as e:
             error_message = str(e)
-            flask_app.logger.error(f"Error downloading '{log_entry.filename}': {error_message}", exc_info=True)
+            flask_app.logger.error(f"Error downloading '{filename}': {error_message}", exc_info=True)
             log_entry.status = DownloadStatus.FAILED
             log_entry.speed_bps = 0
             log_entry.error_message = error_message[:255]
             db.session.commit()
 
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-                flask_app.logger.info(f"Removed temporary file for failed download: {temp_filepath}")
\ No newline at end of file
+            _remove_temp_file(flask_app, temp_filepath, 'failed')